@@ -3,21 +3,40 @@ import streamlit as st
 import tempfile
 import re
 import time
+import datetime
+import hashlib
+import functools
+import html
+import logging
 from pathlib import Path
-from utils.pdf_processor import PDFProcessor
-from utils.vector_db import VectorDBManager
-from utils.openai_manager import OpenAIModelManager
 from utils.database import register_user, authenticate_user
-from qdrant_client import QdrantClient
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Minimum cosine similarity for a cached answer to be reused
+SEMANTIC_CACHE_THRESHOLD = 0.92
+
+# Secret used to sign remembered-login tokens (logins aren't remembered when unset)
+AUTH_TOKEN_SECRET = os.getenv("AUTH_TOKEN_SECRET")
+AUTH_TOKEN_TTL = 3600
+AUTH_COOKIE_NAME = "auth_token"
+
+# Pattern used to validate emails on registration
+_EMAIL_RE = re.compile(r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$")
+
 # Function to validate email
 def is_valid_email(email):
-    pattern = r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$"
-    return re.match(pattern, email) is not None
+    return _EMAIL_RE.match(email) is not None
+
+# Function to get a shared Qdrant client for a URL
+@functools.lru_cache(maxsize=4)
+def _get_client(url):
+    from qdrant_client import QdrantClient
+    return QdrantClient(url=url, prefer_grpc=True)
 
 # Function to delete a Qdrant collection
 def delete_collection(collection_name, qdrant_url=None):
@@ -25,12 +44,116 @@ def delete_collection(collection_name, qdrant_url=None):
         qdrant_url = os.environ.get("QDRANT_URL", "http://localhost:6333")
     
     try:
-        client = QdrantClient(url=qdrant_url)
-        client.delete_collection(collection_name=collection_name)
+        _get_client(qdrant_url).delete_collection(collection_name=collection_name)
         return True, f"Collection '{collection_name}' deleted successfully"
     except Exception as e:
         return False, f"Error deleting collection: {str(e)}"
 
+# Function to get the semantic cache for a collection
+def get_semantic_cache(collection_name):
+    if collection_name not in st.session_state.sem_cache:
+        st.session_state.sem_cache[collection_name] = {"emb": None, "items": []}
+    return st.session_state.sem_cache[collection_name]
+
+# Function to embed a prompt as a unit vector with the vector store's embeddings client
+def embed_prompt(prompt):
+    import numpy as np
+    embeddings = getattr(st.session_state.vector_store, "embeddings", None)
+    if embeddings is None:
+        return None
+    query_embedding = np.asarray(embeddings.embed_query(prompt), dtype=np.float32)
+    return query_embedding / max(np.linalg.norm(query_embedding), 1e-12)
+
+# Function to find a cached answer for a semantically equivalent prompt
+def search_semantic_cache(cache, query_embedding):
+    import numpy as np
+    if cache["emb"] is None or query_embedding is None or len(cache["items"]) == 0:
+        return None
+    
+    # Cached rows are unit length, so a dot product gives the cosine similarity
+    scores = cache["emb"] @ query_embedding.astype(np.float16)
+    best = int(np.argmax(scores))
+    if scores[best] > SEMANTIC_CACHE_THRESHOLD:
+        return cache["items"][best]
+    return None
+
+# Function to get the exact-match cache key for a prompt
+def exact_cache_key(prompt):
+    return hashlib.sha256(prompt.strip().lower().encode()).hexdigest()
+
+# Function to store an answer in the semantic cache
+def store_semantic_cache(cache, query_embedding, answer, source_docs):
+    import numpy as np
+    if query_embedding is None:
+        return
+    
+    if cache["emb"] is None:
+        cache["emb"] = np.empty((0, query_embedding.shape[0]), dtype=np.float16)
+    cache["emb"] = np.vstack([cache["emb"], query_embedding.astype(np.float16)])
+    cache["items"].append((answer, source_docs))
+
+# Function to pre-render source documents into a single HTML block
+def render_sources_html(source_docs):
+    blocks = []
+    for i, doc in enumerate(source_docs):
+        chunk_type = doc.metadata.get('chunk_type', 'standard')
+        parent_id = doc.metadata.get('parent_id', 'N/A')
+        page = doc.metadata.get('page', 'N/A')
+        
+        if chunk_type == "child":
+            location = f"Child Chunk (Parent ID: {parent_id}) - Page {page}"
+        else:
+            location = f"Page {page}"
+        
+        # Line breaks become <br> so the HTML block has no blank line where Markdown parsing would resume
+        content = "<br>".join(html.escape(doc.page_content).splitlines())
+        blocks.append(
+            f"<p><strong>Source {i+1}:</strong></p>"
+            f"<p><em>{html.escape(str(location))}</em></p>"
+            f"<div>{content}</div>"
+        )
+    return "".join(blocks)
+
+# Function to read the remembered-login token sent with the page request
+def read_auth_token():
+    if not AUTH_TOKEN_SECRET:
+        return None
+    return st.context.cookies.get(AUTH_COOKIE_NAME)
+
+# Function to apply the session's pending remembered-login cookie change in the browser.
+# It runs on every page render rather than just before st.rerun(), so the cookie
+# component stays mounted long enough for its script to run.
+def sync_auth_cookie():
+    pending = st.session_state.get("auth_cookie")
+    if not AUTH_TOKEN_SECRET or pending is None:
+        return
+    
+    import extra_streamlit_components as stx
+    cookie_manager = stx.CookieManager(key="auth_cookie_manager")
+    if pending["token"]:
+        cookie_manager.set(AUTH_COOKIE_NAME, pending["token"], key="auth_cookie_set", expires_at=pending["expires_at"])
+    else:
+        try:
+            cookie_manager.delete(AUTH_COOKIE_NAME, key="auth_cookie_delete")
+        except KeyError:
+            # The delete is sent to the browser before the component's local copy is updated
+            pass
+
+# Function to issue a signed login token for a user
+def issue_auth_token(email):
+    import jwt
+    payload = {"email": email, "exp": int(time.time()) + AUTH_TOKEN_TTL}
+    return jwt.encode(payload, AUTH_TOKEN_SECRET, algorithm="HS256")
+
+# Function to get the user email from a valid login token
+# (the token is trusted until it expires; the account isn't re-checked in the database)
+def verify_auth_token(token):
+    import jwt
+    try:
+        return jwt.decode(token, AUTH_TOKEN_SECRET, algorithms=["HS256"]).get("email")
+    except jwt.InvalidTokenError:
+        return None
+
 # Set page configuration
 st.set_page_config(
     page_title="RAG Chatbot",
@@ -63,17 +186,52 @@ if "page" not in st.session_state:
 if "openai_manager" not in st.session_state:
     st.session_state.openai_manager = None
 
-if "detected_language" not in st.session_state:
-    st.session_state.detected_language = None
+if "doc_info" not in st.session_state:
+    st.session_state.doc_info = ""
+
+if "chat_ready" not in st.session_state:
+    st.session_state.chat_ready = False
+
+if "exact_cache" not in st.session_state:
+    st.session_state.exact_cache = {}
+
+if "sem_cache" not in st.session_state:
+    st.session_state.sem_cache = {}
+
+# Function to start a session for an authenticated user
+def start_session(email):
+    st.session_state.logged_in = True
+    st.session_state.user_email = email
+    st.session_state.page = "main"
+    
+    # Initialize OpenAI manager if not already initialized
+    if not st.session_state.openai_manager and os.getenv("OPENAI_API_KEY"):
+        try:
+            from utils.openai_manager import OpenAIModelManager
+            st.session_state.openai_manager = OpenAIModelManager()
+        except ValueError as e:
+            st.error(f"Error initializing OpenAI manager: {str(e)}")
+            st.warning("Please check your OpenAI API key in the .env file.")
 
 # Function to handle login
 def login():
+    # Skip authentication if the user has a valid remembered-login token
+    token = None if st.session_state.get("logged_out") else read_auth_token()
+    if token:
+        email = verify_auth_token(token)
+        if email:
+            start_session(email)
+            st.rerun()
+    
     st.title("Login")
     
-    email = st.text_input("Email")
-    password = st.text_input("Password", type="password")
+    # Inputs live in a form so typing doesn't rerun the script
+    with st.form("login_form"):
+        email = st.text_input("Email")
+        password = st.text_input("Password", type="password")
+        submitted = st.form_submit_button("Login")
     
-    if st.button("Login"):
+    if submitted:
         if not email or not password:
             st.error("Please fill in all fields")
             return
@@ -81,18 +239,13 @@ def login():
         # Authenticate user with database
         success, message = authenticate_user(email, password)
         if success:
-            st.session_state.logged_in = True
-            st.session_state.user_email = email
-            st.session_state.page = "main"
+            start_session(email)
+            
+            # Remember the login so repeat visits skip password verification
+            if AUTH_TOKEN_SECRET:
+                expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=AUTH_TOKEN_TTL)
+                st.session_state.auth_cookie = {"token": issue_auth_token(email), "expires_at": expires_at}
             
-            # Initialize OpenAI manager if not already initialized
-            if not st.session_state.openai_manager and os.getenv("OPENAI_API_KEY"):
-                try:
-                    st.session_state.openai_manager = OpenAIModelManager()
-                except ValueError as e:
-                    st.error(f"Error initializing OpenAI manager: {str(e)}")
-                    st.warning("Please check your OpenAI API key in the .env file.")
-                
             st.success("Login successful!")
             st.rerun()
         else:
@@ -107,11 +260,14 @@ def login():
 def register():
     st.title("Registration")
     
-    email = st.text_input("Email")
-    password = st.text_input("Password", type="password")
-    confirm_password = st.text_input("Confirm Password", type="password")
+    # Inputs live in a form so typing doesn't rerun the script
+    with st.form("register_form"):
+        email = st.text_input("Email")
+        password = st.text_input("Password", type="password")
+        confirm_password = st.text_input("Confirm Password", type="password")
+        submitted = st.form_submit_button("Register")
     
-    if st.button("Register"):
+    if submitted:
         if not email or not password or not confirm_password:
             st.error("Please fill in all fields")
             return
@@ -140,6 +296,11 @@ def register():
 
 # Function to handle logout
 def logout():
+    # Clearing the cookie is best-effort: it happens in the browser on the next
+    # render, and a token that was copied elsewhere stays valid until it expires
+    if AUTH_TOKEN_SECRET:
+        st.session_state.auth_cookie = {"token": None}
+    st.session_state.logged_out = True
     st.session_state.logged_in = False
     st.session_state.user_email = ""
     st.session_state.page = "login"
@@ -174,33 +335,47 @@ def main_app():
         uploaded_file = st.file_uploader("Choose a PDF file", type="pdf")
         
         if uploaded_file is not None and openai_key:
-            # Save the uploaded file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                pdf_path = tmp_file.name
-            
             if st.button("Process PDF"):
+                # Save the uploaded file temporarily, only when it is about to be processed
+                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+                    tmp_file.write(uploaded_file.getbuffer())
+                    pdf_path = tmp_file.name
+                
                 with st.spinner("Processing PDF..."):
                     try:
-                        # Initialize PDF processor
+                        # Initialize PDF processor (imported here so the login page doesn't load it)
+                        from utils.pdf_processor import PDFProcessor
                         pdf_processor = PDFProcessor()
                         
                         # Process PDF
                         chunks, detected_language = pdf_processor.process_pdf(pdf_path)
-                        st.session_state.chunks = chunks
-                        st.session_state.detected_language = detected_language
                         
-                        # Check if OCR was used for processing
-                        ocr_used = any(chunk.metadata.get("ocr_processed", False) for chunk in chunks if len(chunks) > 0)
-                        st.session_state.ocr_used = ocr_used
+                        # Count chunk types and check for OCR in one pass
+                        parent_count = child_count = 0
+                        ocr_used = False
+                        for chunk in chunks:
+                            chunk_type = chunk.metadata.get("chunk_type")
+                            if chunk_type == "parent":
+                                parent_count += 1
+                            elif chunk_type == "child":
+                                child_count += 1
+                            ocr_used = ocr_used or chunk.metadata.get("ocr_processed", False)
+                        
+                        # Pre-render the document info shown above the chat
+                        doc_info = []
+                        if detected_language:
+                            doc_info.append(f"Document language: {detected_language}")
+                            if ocr_used:
+                                doc_info.append("OCR processing was used for text extraction due to non-English content")
+                        if chunks:
+                            doc_info.append(f"Using hierarchical chunking with {parent_count} parent chunks and {child_count} child chunks")
+                        st.session_state.doc_info = "\n\n".join(doc_info)
                         
                         # Display detected language
                         st.success(f"PDF processed successfully! Created {len(chunks)} chunks.")
                         
                         # Show chunking stats
-                        parent_chunks = [c for c in chunks if c.metadata.get("chunk_type") == "parent"]
-                        child_chunks = [c for c in chunks if c.metadata.get("chunk_type") == "child"]
-                        st.info(f"Created {len(parent_chunks)} parent chunks and {len(child_chunks)} child chunks")
+                        st.info(f"Created {parent_count} parent chunks and {child_count} child chunks")
                         
                         # Display language information
                         st.info(f"Detected language: {detected_language}")
@@ -211,6 +386,7 @@ def main_app():
                         
                         # Initialize vector database
                         try:
+                            from utils.vector_db import VectorDBManager
                             vector_db_manager = VectorDBManager()
                             
                             # Create vector store
@@ -219,9 +395,14 @@ def main_app():
                                 collection_name=st.session_state.collection_name
                             )
                             
+                            # Drop cached answers from a previously processed document
+                            st.session_state.exact_cache = {}
+                            st.session_state.sem_cache.pop(st.session_state.collection_name, None)
+                            
                             # Initialize OpenAI manager if not already initialized
                             if not st.session_state.openai_manager:
                                 try:
+                                    from utils.openai_manager import OpenAIModelManager
                                     st.session_state.openai_manager = OpenAIModelManager()
                                 except ValueError as e:
                                     st.error(f"Error initializing OpenAI manager: {str(e)}")
@@ -233,6 +414,8 @@ def main_app():
                                 vector_store=st.session_state.vector_store
                             )
                             
+                            st.session_state.chat_ready = True
+                            
                             st.success("Vector store and retrieval chain created successfully!")
                         
                         except Exception as e:
@@ -252,23 +435,12 @@ def main_app():
     # Main chat interface
     st.header("Chat")
     
-    # Display detected language if available
-    if st.session_state.detected_language:
-        language_info = f"Document language: {st.session_state.detected_language}"
-        st.info(language_info)
-        
-        # Display OCR information if available and used
-        if hasattr(st.session_state, 'ocr_used') and st.session_state.ocr_used:
-            st.info("OCR processing was used for text extraction due to non-English content")
-    
-    # Display chunking information
-    if hasattr(st.session_state, 'chunks') and st.session_state.chunks:
-        parent_chunks = [c for c in st.session_state.chunks if c.metadata.get("chunk_type") == "parent"]
-        child_chunks = [c for c in st.session_state.chunks if c.metadata.get("chunk_type") == "child"]
-        st.info(f"Using hierarchical chunking with {len(parent_chunks)} parent chunks and {len(child_chunks)} child chunks")
+    # Display document language, OCR and chunking information
+    if st.session_state.doc_info:
+        st.info(st.session_state.doc_info)
     
     # Check if OpenAI API key is provided
-    if not os.getenv("OPENAI_API_KEY") and not st.session_state.openai_manager:
+    if not st.session_state.openai_manager and not os.getenv("OPENAI_API_KEY"):
         st.warning("⚠️ OpenAI API key is required. Please add it to your .env file.")
     
     # Display chat messages
@@ -277,22 +449,12 @@ def main_app():
             st.write(message["content"])
             
             # Display source documents for AI messages
-            if message["role"] == "assistant" and "source_docs" in message:
+            if message["role"] == "assistant" and message.get("sources_html"):
                 with st.expander("View Sources"):
-                    for i, doc in enumerate(message["source_docs"]):
-                        st.markdown(f"**Source {i+1}:**")
-                        chunk_type = doc.metadata.get('chunk_type', 'standard')
-                        parent_id = doc.metadata.get('parent_id', 'N/A')
-                        
-                        if chunk_type == "child":
-                            st.markdown(f"*Child Chunk (Parent ID: {parent_id}) - Page {doc.metadata.get('page', 'N/A')}*")
-                        else:
-                            st.markdown(f"*Page {doc.metadata.get('page', 'N/A')}*")
-                            
-                        st.markdown(doc.page_content)
+                    st.markdown(message["sources_html"], unsafe_allow_html=True)
 
     # Chat input
-    chat_disabled = not (st.session_state.chain is not None and st.session_state.openai_manager is not None)
+    chat_disabled = not st.session_state.chat_ready
     
     if chat_disabled:
         st.info("Please upload and process a PDF document and ensure OpenAI API key is provided in the .env file to start chatting.")
@@ -310,39 +472,52 @@ def main_app():
             with st.chat_message("assistant"):
                 with st.spinner("Thinking..."):
                     try:
-                        # Call the chain to get a response
-                        response = st.session_state.openai_manager.generate_response(
-                            chain=st.session_state.chain,
-                            query=prompt
-                        )
+                        # Look up the prompt in the exact and semantic caches before calling the chain
+                        cache = get_semantic_cache(st.session_state.collection_name)
+                        prompt_key = exact_cache_key(prompt)
+                        cached = st.session_state.exact_cache.get(prompt_key)
+                        query_embedding = None
+                        if cached is None:
+                            # The cache is only an optimization, so a failed lookup counts as a miss
+                            try:
+                                query_embedding = embed_prompt(prompt)
+                                cached = search_semantic_cache(cache, query_embedding)
+                            except Exception:
+                                logger.exception("Semantic cache lookup failed")
+                                query_embedding = None
+                            if cached is not None:
+                                st.session_state.exact_cache[prompt_key] = cached
                         
-                        # Extract answer and source documents
-                        answer = response.get("answer", "I couldn't find an answer to that question.")
-                        source_docs = response.get("source_documents", [])
+                        if cached is not None:
+                            answer, source_docs = cached
+                        else:
+                            # Call the chain to get a response
+                            response = st.session_state.openai_manager.generate_response(
+                                chain=st.session_state.chain,
+                                query=prompt
+                            )
+                            
+                            # Extract answer and source documents
+                            answer = response.get("answer", "I couldn't find an answer to that question.")
+                            source_docs = response.get("source_documents", [])
+                            
+                            st.session_state.exact_cache[prompt_key] = (answer, source_docs)
+                            store_semantic_cache(cache, query_embedding, answer, source_docs)
                         
                         # Display the answer
                         st.write(answer)
                         
                         # Display source documents
-                        if source_docs:
+                        sources_html = render_sources_html(source_docs)
+                        if sources_html:
                             with st.expander("View Sources"):
-                                for i, doc in enumerate(source_docs):
-                                    st.markdown(f"**Source {i+1}:**")
-                                    chunk_type = doc.metadata.get('chunk_type', 'standard')
-                                    parent_id = doc.metadata.get('parent_id', 'N/A')
-                                    
-                                    if chunk_type == "child":
-                                        st.markdown(f"*Child Chunk (Parent ID: {parent_id}) - Page {doc.metadata.get('page', 'N/A')}*")
-                                    else:
-                                        st.markdown(f"*Page {doc.metadata.get('page', 'N/A')}*")
-                                        
-                                    st.markdown(doc.page_content)
+                                st.markdown(sources_html, unsafe_allow_html=True)
                         
                         # Add to chat history
                         st.session_state.messages.append({
                             "role": "assistant", 
                             "content": answer,
-                            "source_docs": source_docs
+                            "sources_html": sources_html
                         })
                     except Exception as e:
                         error_msg = f"Error generating response: {str(e)}"
@@ -362,6 +537,7 @@ def main_app():
     
 # Run the appropriate page
 if __name__ == "__main__":
+    sync_auth_cookie()
     if st.session_state.page == "login" and not st.session_state.logged_in:
         login()
     elif st.session_state.page == "register" and not st.session_state.logged_in: